@@ -1,12 +1,18 @@
+import io
 import os
+import re
 import json
 import datetime
+from dataclasses import dataclass
 from typing import List, Dict, Any, Optional
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 import yfinance as yf
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # =========================
 # CONFIG / SECRETS HELPERS
@@ -19,81 +25,237 @@ def get_secret(section: str, key: str, default: str = "") -> str:
     return os.getenv(key, default)
 
 
+@dataclass(frozen=True)
+class AppConfig:
+    gumroad_product_id: str    # <- the real product id from JSON
+    gumroad_access_token: str  # optional
+    openai_api_key: str        # optional
+    max_uses_per_day: int
+    max_tickers_per_run: int
+
+
+@st.cache_resource(show_spinner=False)
+def load_config() -> AppConfig:
+    """Read all secrets once per process instead of on every rerun."""
+    return AppConfig(
+        gumroad_product_id=get_secret("gumroad", "PRODUCT_ID", ""),
+        gumroad_access_token=get_secret("gumroad", "ACCESS_TOKEN", ""),
+        openai_api_key=get_secret("openai", "OPENAI_API_KEY", ""),
+        max_uses_per_day=int(get_secret("app", "MAX_USES_PER_DAY", "50")),
+        max_tickers_per_run=int(get_secret("app", "MAX_TICKERS_PER_RUN", "25")),
+    )
+
+
 # ---- read secrets ----
-GUMROAD_PRODUCT_ID = get_secret("gumroad", "PRODUCT_ID", "")   # <- the real product id from JSON
-GUMROAD_ACCESS_TOKEN = get_secret("gumroad", "ACCESS_TOKEN", "")  # optional
-OPENAI_API_KEY = get_secret("openai", "OPENAI_API_KEY", "")       # optional
-MAX_USES_PER_DAY = int(get_secret("app", "MAX_USES_PER_DAY", "50"))
+CONFIG = load_config()
 
 # =========================
 # GUMROAD LICENSE VERIFY
 # =========================
 
-def verify_gumroad_license(license_key: str) -> Dict[str, Any]:
+# Gumroad keys look like XXXXXXXX-XXXXXXXX-XXXXXXXX-XXXXXXXX
+_LICENSE_RE = re.compile(r"^[A-Z0-9]{8}(?:-[A-Z0-9]{8}){3}$", re.IGNORECASE)
+
+
+@st.cache_resource
+def _http() -> requests.Session:
+    """Process-wide keep-alive session so repeat verifies reuse the TLS connection."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+class _LicenseRejected(Exception):
+    """Raised inside the cached verifier so failed checks are never cached."""
+
+    def __init__(self, data: Dict[str, Any]):
+        super().__init__(data.get("message", ""))
+        self.data = data
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _verify_gumroad_license_cached(
+    license_key: str,
+    product_id: str,
+    access_token: str,
+) -> Dict[str, Any]:
     """
     Call Gumroad license verify endpoint.
     We always send the product_id (NOT permalink).
     If ACCESS_TOKEN is present, we send it too.
+    product_id / access_token are args so the cache is keyed per product.
     """
     url = "https://api.gumroad.com/v2/licenses/verify"
     payload = {
-        "license_key": license_key.strip(),
-        "product_id": GUMROAD_PRODUCT_ID,
+        "license_key": license_key,
+        "product_id": product_id,
     }
-    if GUMROAD_ACCESS_TOKEN:
-        payload["access_token"] = GUMROAD_ACCESS_TOKEN
+    if access_token:
+        payload["access_token"] = access_token
 
     try:
-        resp = requests.post(url, data=payload, timeout=10)
+        resp = _http().post(url, data=payload, timeout=10)
         data = resp.json()
-        return data
     except Exception as e:
-        return {
+        data = {
             "success": False,
             "message": f"Request to Gumroad failed: {e}",
         }
+    if not data.get("success"):
+        # st.cache_data doesn't store exceptions -> next click retries Gumroad
+        raise _LicenseRejected(data)
+    return data
+
+
+def verify_gumroad_license(license_key: str) -> Dict[str, Any]:
+    """
+    Verify a license, reusing earlier successes.
+    Keys already verified in this session skip the cache and network entirely.
+    """
+    key = license_key.strip()
+    if not _LICENSE_RE.match(key):
+        # obvious typo -> don't spend a Gumroad round-trip on it
+        return {
+            "success": False,
+            "message": "That doesn't look like a Gumroad license key (XXXXXXXX-XXXXXXXX-XXXXXXXX-XXXXXXXX).",
+        }
+
+    verified = st.session_state.setdefault("verified_keys", set())
+    if key in verified:
+        return {"success": True}
+
+    try:
+        data = _verify_gumroad_license_cached(
+            key, CONFIG.gumroad_product_id, CONFIG.gumroad_access_token
+        )
+    except _LicenseRejected as e:
+        return e.data
+    verified.add(key)
+    return data
+
+
+def _today() -> str:
+    """Quota date stamp for the current local day, e.g. '2024-05-01'."""
+    return datetime.date.today().isoformat()
+
+
+def used_today() -> int:
+    """Analyses run today; resets the counter when the day rolls over."""
+    today = _today()
+    if st.session_state.get("quota_date") != today:
+        st.session_state["quota_date"] = today
+        st.session_state["quota_count"] = 0
+    return st.session_state["quota_count"]
 
 
 def check_daily_quota() -> bool:
     """True if user still has uses left today."""
-    today = datetime.date.today().isoformat()
-    if "usage" not in st.session_state:
-        st.session_state["usage"] = {}
-    usage = st.session_state["usage"]
-    used_today = usage.get(today, 0)
-    return used_today < MAX_USES_PER_DAY
+    return used_today() < CONFIG.max_uses_per_day
 
 
 def record_usage():
-    today = datetime.date.today().isoformat()
-    if "usage" not in st.session_state:
-        st.session_state["usage"] = {}
-    st.session_state["usage"][today] = st.session_state["usage"].get(today, 0) + 1
+    st.session_state["quota_count"] = used_today() + 1
 
 
 # =========================
 # DATA FETCHING
 # =========================
 
+YF_BATCH_SIZE = 20  # symbols per yf.download request
+
+
+class _NoMarketData(Exception):
+    """
+    Raised inside the cached fetchers when Yahoo returned nothing usable.
+    yf.download swallows per-ticker errors (rate limits included) and just
+    returns empty frames; raising keeps st.cache_data from storing that.
+    """
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_price_data_cached(ticker: str, period: str, interval: str) -> pd.DataFrame:
+    df = yf.download(ticker, period=period, interval=interval, progress=False)
+    if df is None or df.empty:
+        raise _NoMarketData(ticker)
+    if isinstance(df.columns, pd.MultiIndex):
+        # newer yfinance: (Price, Ticker) header even for one ticker
+        df.columns = df.columns.get_level_values(0)
+    return df.reset_index()
+
+
 def fetch_price_data(
     ticker: str,
     period: str = "5d",
     interval: str = "30m",
 ) -> Optional[pd.DataFrame]:
     """
-    Fetch OHLCV with yfinance.
+    Fetch OHLCV with yfinance (cached 5 min).
     Returns None if no data.
     """
     try:
-        df = yf.download(ticker, period=period, interval=interval, progress=False)
-        if df is None or df.empty:
-            return None
-        df = df.reset_index()
-        return df
-    except Exception:
+        return _fetch_price_data_cached(ticker, period, interval)
+    except _NoMarketData:
         return None
 
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_chunk_cached(
+    chunk: List[str],
+    period: str,
+    interval: str,
+) -> Dict[str, Optional[pd.DataFrame]]:
+    """One yf.download for up to YF_BATCH_SIZE symbols, sliced per ticker."""
+    raw = yf.download(
+        " ".join(chunk),
+        period=period,
+        interval=interval,
+        group_by="ticker",
+        threads=True,
+        progress=False,
+    )
+    out: Dict[str, Optional[pd.DataFrame]] = {t: None for t in chunk}
+    if raw is not None and not raw.empty:
+        for ticker in chunk:
+            if ticker not in raw.columns.get_level_values(0):
+                continue
+            df = raw[ticker].dropna(how="all")
+            if not df.empty:
+                out[ticker] = df.reset_index()
+
+    if all(df is None for df in out.values()):
+        raise _NoMarketData(" ".join(chunk))
+    return out
+
+
+def fetch_price_data_batch(
+    tickers: List[str],
+    period: str = "5d",
+    interval: str = "30m",
+) -> Dict[str, Optional[pd.DataFrame]]:
+    """
+    Fetch OHLCV for many tickers in one yfinance call per YF_BATCH_SIZE symbols
+    (each chunk cached 5 min). Returns {ticker: df or None}, same per-ticker
+    shape as fetch_price_data. A chunk that comes back empty leaves only its
+    own tickers as None and is retried on the next call.
+    """
+    if len(tickers) == 1:
+        return {tickers[0]: fetch_price_data(tickers[0], period=period, interval=interval)}
+
+    out: Dict[str, Optional[pd.DataFrame]] = {t: None for t in tickers}
+    for i in range(0, len(tickers), YF_BATCH_SIZE):
+        chunk = tickers[i:i + YF_BATCH_SIZE]
+        try:
+            out.update(_fetch_chunk_cached(chunk, period, interval))
+        except _NoMarketData:
+            continue
+    return out
+
+
 # simple timeframe map from the selectbox label
 TIMEFRAME_MAP = {
     "5 days (1d)": ("5d", "1d"),
@@ -102,6 +264,7 @@ TIMEFRAME_MAP = {
     "3 months (1d)": ("3mo", "1d"),
     "1 year (1d)": ("1y", "1d"),
 }
+TIMEFRAME_LABELS = tuple(TIMEFRAME_MAP.keys())
 
 # static “most traded” for now
 TOP_10_MOST_TRADED_US = [
@@ -109,6 +272,14 @@ TOP_10_MOST_TRADED_US = [
     "META", "GOOGL", "AVGO", "AMD", "NFLX"
 ]
 
+def parse_tickers(raw: str) -> List[str]:
+    """
+    Split comma-separated input into upper-case symbols, keeping order.
+    Only commas separate, so Yahoo symbols like GC=F, EURUSD=X, ^GSPC pass through intact.
+    """
+    return [s for s in (t.strip() for t in raw.upper().split(",")) if s]
+
+
 # =========================
 # AI COMMENT (optional)
 # =========================
@@ -118,7 +289,7 @@ def ai_comment_on_ticker(ticker: str, momentum: float, latest_price: float) -> s
     Very lightweight stub. If OPENAI key exists, we give a nicer sentence.
     We won't actually call OpenAI here to keep it simple.
     """
-    if not OPENAI_API_KEY:
+    if not CONFIG.openai_api_key:
         # fallback text
         if momentum > 0:
             return f"{ticker} shows positive short-term price change. Watch for continuation."
@@ -135,6 +306,77 @@ def ai_comment_on_ticker(ticker: str, momentum: float, latest_price: float) -> s
         )
 
 
+# =========================
+# PER-TICKER ANALYSIS
+# =========================
+
+def _closes(df: pd.DataFrame) -> np.ndarray:
+    """Close prices as a float64 array (no copy when already float64)."""
+    return df["Close"].to_numpy(dtype=np.float64, copy=False)
+
+
+def _data_error(df: Optional[pd.DataFrame]) -> Optional[str]:
+    """Why a frame can't be analyzed, or None if it's usable."""
+    if df is None or df.empty:
+        return "No market data for this ticker."
+    # we expect a 'Close' column
+    if "Close" not in df.columns:
+        return "Downloaded data does not contain 'Close' prices."
+    return None
+
+
+def analyze_tickers(
+    tickers: List[str],
+    frames: Dict[str, Optional[pd.DataFrame]],
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Compute everything we show for each ticker, without touching the UI.
+    Price changes for all tickers are done in one vectorized numpy pass.
+    Tickers whose data can't be used get {"error": msg}.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    ok: List[str] = []
+    # preallocated, filled by index; trimmed to len(ok) below
+    latest = np.empty(len(tickers), dtype=np.float64)
+    prev = np.empty(len(tickers), dtype=np.float64)
+
+    for ticker in tickers:
+        df = frames.get(ticker)
+        err = _data_error(df)
+        if err:
+            results[ticker] = {"error": err}
+            continue
+        # one numpy view, plain integer indexing (no pandas scalar lookups)
+        close = _closes(df)
+        n = len(ok)
+        latest[n] = close[-1]
+        prev[n] = close[-2] if close.size > 1 else close[-1]
+        ok.append(ticker)
+
+    # ------------- price change / momentum (all tickers at once) -------------
+    latest, prev = latest[:len(ok)], prev[:len(ok)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(prev != 0, (latest - prev) / prev * 100, 0.0)
+
+    for i, ticker in enumerate(ok):
+        last_i, pct_i = float(latest[i]), float(pct[i])
+        results[ticker] = {
+            "latest": last_i,
+            "pct": pct_i,
+            "comment": ai_comment_on_ticker(ticker, pct_i, last_i),
+        }
+    return results
+
+
+# same TTL as the fetch caches; max_entries bounds memory on long-running servers
+@st.cache_data(ttl=300, max_entries=50, show_spinner=False)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """UTF-8 CSV written straight into a byte buffer (no str -> encode copy)."""
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, lineterminator="\n")
+    return buf.getvalue()
+
+
 # =========================
 # STREAMLIT APP
 # =========================
@@ -150,7 +392,7 @@ with st.container(border=True):
     lic = st.text_input("License key", type="password")
 
     if st.button("Unlock", type="primary"):
-        if not GUMROAD_PRODUCT_ID:
+        if not CONFIG.gumroad_product_id:
             st.error("Gumroad product_id is missing in Streamlit secrets. Add it under [gumroad].")
         elif not lic:
             st.error("Please enter a license key.")
@@ -165,9 +407,7 @@ with st.container(border=True):
                 st.error(f"❌ {data.get('message','License could not be verified.')}")
 
 # show today's usage
-today = datetime.date.today().isoformat()
-used = st.session_state.get("usage", {}).get(today, 0)
-st.caption(f"Today: {used} / {MAX_USES_PER_DAY}")
+st.caption(f"Today: {used_today()} / {CONFIG.max_uses_per_day}")
 
 # ---- stop here if not licensed ----
 if not st.session_state.get("licensed", False):
@@ -204,7 +444,7 @@ with col1:
 with col2:
     timeframe_label = st.selectbox(
         "Timeframe",
-        list(TIMEFRAME_MAP.keys()),
+        TIMEFRAME_LABELS,
         index=1,  # default "5 days (30m)"
     )
 with col3:
@@ -215,12 +455,18 @@ with col3:
 
 if input_mode == "Manual tickers":
     raw_tickers = st.text_input("Tickers (comma separated)", value="AAPL, TSLA, NVDA")
-    tickers = [t.strip().upper() for t in raw_tickers.split(",") if t.strip()]
 else:
     st.info("Using preset: Top 10 most traded US stocks (static list).")
-    tickers = TOP_10_MOST_TRADED_US
 
-do_analyze = st.button("🚀 Analyze now")
+btn_col1, btn_col2 = st.columns([1, 5])
+with btn_col1:
+    do_analyze = st.button("🚀 Analyze now")
+with btn_col2:
+    # market data is cached for 5 min; let users force a fresh pull
+    if st.button("🔄 Refresh data"):
+        _fetch_price_data_cached.clear()
+        _fetch_chunk_cached.clear()
+        st.toast("Market data cache cleared.")
 
 # =========================
 # RUN ANALYSIS
@@ -229,61 +475,60 @@ if do_analyze:
     # record usage at the moment user clicks
     record_usage()
 
+    # parse only when we actually run (other widget reruns skip this)
+    if input_mode == "Manual tickers":
+        found = parse_tickers(raw_tickers)
+        # dedupe (order kept) so "AAPL, aapl" is fetched once
+        tickers = list(dict.fromkeys(found))
+        if len(tickers) < len(found):
+            st.warning(f"Removed {len(found) - len(tickers)} duplicate ticker(s).")
+        if len(tickers) > CONFIG.max_tickers_per_run:
+            st.warning(f"Only the first {CONFIG.max_tickers_per_run} tickers will be analyzed.")
+            tickers = tickers[:CONFIG.max_tickers_per_run]
+    else:
+        tickers = TOP_10_MOST_TRADED_US
+
     period, interval = TIMEFRAME_MAP[timeframe_label]
 
+    # one Yahoo round-trip for all tickers instead of one per ticker
+    frames = fetch_price_data_batch(tickers, period=period, interval=interval)
+
+    # compute all tickers first, then render (keeps st.* calls in one place)
+    results = analyze_tickers(tickers, frames)
+
     for ticker in tickers:
         st.subheader(f"📊 {ticker}  ↪")
-        df = fetch_price_data(ticker, period=period, interval=interval)
+        df = frames.get(ticker)
+        res = results[ticker]
 
-        if df is None or df.empty:
-            st.warning("No market data for this ticker.")
+        if "error" in res:
+            st.warning(res["error"])
             continue
 
-        # we expect a 'Close' column
-        if "Close" not in df.columns:
-            st.warning("Downloaded data does not contain 'Close' prices.")
-            continue
-
-        # ------------- price change / momentum -------------
-        latest = float(df["Close"].iloc[-1])
-        if len(df) > 1:
-            prev = float(df["Close"].iloc[-2])
-        else:
-            prev = latest
-        pct = ((latest - prev) / prev * 100) if prev != 0 else 0.0
-
         # ------------- show basic stats -------------
         stats_cols = st.columns(3)
         with stats_cols[0]:
-            st.metric("Last price", f"${latest:.2f}")
+            st.metric("Last price", f"${res['latest']:.2f}")
         with stats_cols[1]:
-            st.metric("Last candle %", f"{pct:.2f}%")
+            st.metric("Last candle %", f"{res['pct']:.2f}%")
         with stats_cols[2]:
             st.write(f"Rows: {len(df)}")
 
         # ------------- chart -------------
-        # we'll build a small combined frame with price + volume
-        chart_df = df.set_index(df.columns[0])  # datetime index
-        # Only keep columns that exist
-        keep_cols = []
-        if "Close" in chart_df.columns:
-            keep_cols.append("Close")
-        if "Volume" in chart_df.columns:
-            keep_cols.append("Volume")
+        # price + volume straight from df, first column (datetime) as x -> no set_index copy
+        keep_cols = [c for c in ("Close", "Volume") if c in df.columns]
         if keep_cols:
-            st.line_chart(chart_df[keep_cols])
+            st.line_chart(df, x=df.columns[0], y=keep_cols)
         else:
             st.info("No chartable columns found.")
 
         # ------------- AI comment -------------
-        comment = ai_comment_on_ticker(ticker, pct, latest)
-        st.write(f"🧠 {comment}")
+        st.write(f"🧠 {res['comment']}")
 
         # ------------- CSV export -------------
-        csv = df.to_csv(index=False).encode("utf-8")
         st.download_button(
             label=f"Download {ticker} CSV",
-            data=csv,
+            data=to_csv_bytes(df),
             file_name=f"{ticker.lower()}_data.csv",
             mime="text/csv",
         )